@@ -2,7 +2,7 @@
 import subprocess
 import numpy as np
 from scipy.io import mmread
-from itertools import permutations
+from itertools import combinations
 
 from .vireo_base import match
 from .vcf_utils import load_VCF, write_VCF, parse_donor_GPb
@@ -108,7 +108,8 @@ def write_donor_id(out_dir, donor_names, cell_names, n_vars, res_vireo):
     prob_doublet_out = np.sum(doublet_prob, axis=1)
     donor_singlet = np.array(donor_names, "U100")[np.argmax(ID_prob, axis=1)]
 
-    doublet_names = [",".join(x) for x in permutations(donor_names, 2)]
+    ## doublet columns follow the combinations ordering in add_doublet_GT
+    doublet_names = [",".join(x) for x in combinations(donor_names, 2)]
     donor_doublet = np.array(doublet_names, "U100")[np.argmax(doublet_prob, 
                                                               axis=1)]
 
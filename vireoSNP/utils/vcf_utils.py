@@ -2,7 +2,9 @@
 # Author: Yuanhua Huang
 # Date: 24/06/2019
 
+import io
 import os
+import csv
 import sys
 import gzip
 import subprocess
@@ -11,14 +13,19 @@ import numpy as np
 def parse_sample_info(sample_dat, sparse=True, format_list=None):
     """
     Parse genotype information for each sample
-    Note, it requires the format for each variants to 
+    Note, it requires the format for each variants to
     be the same.
+
+    sample_dat can be a list of rows or a 2D numpy array with the FORMAT
+    string in column 0 and one column per sample afterwards.
     """
-    if sample_dat == [] or sample_dat is None:
+    if sample_dat is None or len(sample_dat) == 0:
         return None
 
+    sample_dat = np.asarray(sample_dat, dtype=object)
+
     # require the same format for all variants
-    format_all = [x[0].split(":") for x in sample_dat]
+    format_all = [x.split(":") for x in sample_dat[:, 0]]
     if format_list is None:
         format_list = format_all[0]
 
@@ -32,36 +39,48 @@ def parse_sample_info(sample_dat, sparse=True, format_list=None):
             print("Error: require the same format for all variants.")
             exit()
 
-        RV['indices'] = []
-        RV['indptr'] = [0]
-        RV['shape'] = (len(sample_dat[0][1:]), len(sample_dat))
         missing_val = ":".join(["."] * len(format_list))
-        
-        cnt = 0
-        for j in range(len(sample_dat)): #variant j
-            _line = sample_dat[j]
-            key_idx = [format_all[j].index(_key) for _key in format_list]
-            for i in range(len(_line[1:])): #cell i
-                if _line[i+1] == missing_val or _line[i+1] == ".":
-                    continue
-                _line_key = _line[i+1].split(":")
-                for k in range(len(format_list)):
-                    RV[format_list[k]].append(_line_key[key_idx[k]])
-
-                cnt += 1
-                RV['indices'].append(i)
-            RV['indptr'].append(cnt)
+        cell_dat = sample_dat[:, 1:]  #(n_var, n_cell)
+        mask = (cell_dat != missing_val) & (cell_dat != ".")
+
+        RV['shape'] = (cell_dat.shape[1], cell_dat.shape[0])
+        RV['indptr'] = np.append(0, np.cumsum(mask.sum(axis=1)))
+        RV['indices'] = np.nonzero(mask)[1].astype(np.int32)
+
+        ## split all non-missing entries at once (variant-major order)
+        flat_split = np.array([x.split(":") for x in cell_dat[mask]],
+                              dtype=object)
+        key_idx = np.array([[_fmt.index(_key) for _key in format_list]
+                            for _fmt in format_all])
+        if flat_split.shape[0] == 0:
+            pass
+        elif np.all(key_idx == key_idx[0, :]):
+            for k in range(len(format_list)):
+                ## keep fields as '<U' arrays; downstream consumers take
+                ## ndarrays directly without re-listifying
+                RV[format_list[k]] = \
+                    flat_split[:, key_idx[0, k]].astype(np.str_)
+        else:
+            ## rare: same keys but per-variant ordering differs
+            var_idx = np.repeat(np.arange(mask.shape[0]), mask.sum(axis=1))
+            for k in range(len(format_list)):
+                RV[format_list[k]] = flat_split[
+                    np.arange(flat_split.shape[0]),
+                    key_idx[var_idx, k]].astype(np.str_)
     else:
-        for j in range(len(sample_dat)): #variant j
-            _line = sample_dat[j]
-            _line_split = [x.split(":") for x in _line[1:]]
+        cell_dat = np.asarray(sample_dat[:, 1:], dtype=np.str_)
+        n_var, n_cell = cell_dat.shape
+        ## preallocate one string matrix per FORMAT key; a whole entry
+        ## upper-bounds the width of any of its fields
+        _dtype = "<U%d" % max(1, cell_dat.dtype.itemsize // 4)
+        for _key in format_list:
+            RV[_key] = np.full((n_var, n_cell), ".", dtype=_dtype)
+        for j in range(n_var): #variant j
+            _line_split = [x.split(":") for x in cell_dat[j]]
             for _key in format_list:
                 if _key in format_all[j]:
                     k = format_all[j].index(_key)
-                    _line_key = [x[k] for x in _line_split]
-                    RV[_key].append(_line_key)
-                else:
-                    RV[_key].append(".")
+                    RV[_key][j, :] = [x[k] for x in _line_split]
     return RV
 
 
@@ -78,44 +97,63 @@ def load_VCF(vcf_file, biallelic_only=False, load_sample=True, sparse=True,
 
     Note, it may take a large memory, please filter the VCF with bcftools first.
     """
+    import pandas as pd
+
     if vcf_file[-3:] == ".gz" or vcf_file[-4:] == ".bgz":
-        infile = gzip.open(vcf_file, "rb")
-        is_gzip = True
+        ## python-isal decompresses ~3x faster than zlib when available
+        try:
+            from isal import igzip
+            raw = igzip.open(vcf_file, "rb")
+        except ImportError:
+            raw = gzip.open(vcf_file, "rb")
+        ## a large read buffer avoids many small zlib.decompress calls
+        infile = io.BufferedReader(raw, buffer_size=1 << 20)
     else:
-        infile = open(vcf_file, "r")
-        is_gzip = False
-    
+        infile = open(vcf_file, "rb")
+
     FixedINFO = {}
     contig_lines = []
     comment_lines = []
+    key_ids = []
     var_ids, obs_ids, obs_dat = [], [], []
-    
+
+    ## pass 1: the header block only, stopping at the "#CHROM" line; only
+    ## these few lines are decoded in Python
     for line in infile:
-        if is_gzip:
-            line = line.decode('utf-8')
-        if line.startswith("#"):
-            if line.startswith("##contig="):
-                contig_lines.append(line.rstrip())
-            if line.startswith("#CHROM"):
-                if load_sample:
-                    obs_ids = line.rstrip().split("\t")[9:]
-                key_ids = line[1:].rstrip().split("\t")[:8]
-                for _key in key_ids:
-                    FixedINFO[_key] = []
-            else:
-                comment_lines.append(line.rstrip())
-        else:
-            list_val = line.rstrip().split("\t") #[:5] #:8
-            if biallelic_only:
-                if len(list_val[3]) > 1 or len(list_val[4]) > 1:
-                    continue
+        line = line.decode('utf-8')
+        if line.startswith("##contig="):
+            contig_lines.append(line.rstrip())
+        if line.startswith("#CHROM"):
             if load_sample:
-                obs_dat.append(list_val[8:])
-            for i in range(len(key_ids)):
-                FixedINFO[key_ids[i]].append(list_val[i])
-            var_ids.append("_".join([list_val[x] for x in [0, 1, 3, 4]]))
+                obs_ids = line.rstrip().split("\t")[9:]
+            key_ids = line[1:].rstrip().split("\t")[:8]
+            for _key in key_ids:
+                FixedINFO[_key] = []
+            break
+        else:
+            comment_lines.append(line.rstrip())
+
+    ## pass 2: bulk tokenization of the variant block with pandas' C engine,
+    ## which is much faster than a per-line str.split in Python; the stream
+    ## stays binary so UTF-8 decoding also happens at C level, and lines the
+    ## biallelic filter drops never become Python strings
+    try:
+        df = pd.read_csv(infile, sep="\t", header=None, dtype=str,
+                         na_filter=False, engine='c', encoding='utf-8')
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame()
     infile.close()
 
+    if df.shape[0] > 0:
+        if biallelic_only:
+            _idx = (df[3].str.len() == 1) & (df[4].str.len() == 1)
+            df = df[_idx]
+        var_ids = df[0].str.cat([df[1], df[3], df[4]], sep="_").tolist()
+        for i in range(len(key_ids)):
+            FixedINFO[key_ids[i]] = df[i].tolist()
+        if load_sample:
+            obs_dat = df.iloc[:, 8:].to_numpy()
+
     RV = {}
     RV["variants"]  = var_ids
     RV["FixedINFO"] = FixedINFO
@@ -127,33 +165,84 @@ def load_VCF(vcf_file, biallelic_only=False, load_sample=True, sparse=True,
     return RV
 
 
-def write_VCF_to_hdf5(VCF_dat, out_file):
+def write_VCF_to_hdf5(VCF_dat, out_file, compression="lzf",
+                      compression_opts=None, shuffle=True):
     """
     Write vcf data into hdf5 file
+
+    compression: "lzf" (default; several times faster than gzip with little
+        size difference on VCF strings), "gzip", or any filter id accepted by
+        h5py, e.g., an hdf5plugin.Blosc filter when hdf5plugin is installed.
+    compression_opts: setting for the filter; for gzip the level (default 4).
+    shuffle: whether applying the byte-shuffle filter before compression.
     """
     import h5py
+    _kwargs = dict(compression=compression, shuffle=shuffle)
+    if compression == "gzip":
+        _kwargs["compression_opts"] = \
+            compression_opts if compression_opts is not None else 4
+    elif compression_opts is not None:
+        _kwargs["compression_opts"] = compression_opts
+
+    def _create(group, name, data):
+        if data.shape[0] == 0:
+            return group.create_dataset(name, data=data)
+        ## explicit chunking; h5py's auto chunks can be far too small
+        _chunks = (min(data.shape[0], 1 << 16),) + data.shape[1:]
+        return group.create_dataset(name, data=data, chunks=_chunks, **_kwargs)
+
+    def _create_str(group, name, data):
+        return _create(group, name, np.asarray(data, dtype="S"))
+
     f = h5py.File(out_file, 'w')
-    f.create_dataset("contigs", data=np.string_(VCF_dat['contigs']), 
-                     compression="gzip", compression_opts=9)
-    f.create_dataset("samples", data=np.string_(VCF_dat['samples']), 
-                     compression="gzip", compression_opts=9)
-    f.create_dataset("variants", data=np.string_(VCF_dat['variants']), 
-                     compression="gzip", compression_opts=9)
-    f.create_dataset("comments", data=np.string_(VCF_dat['comments']), 
-                     compression="gzip", compression_opts=9)
-    
-    ## variant fixed information
+    _create_str(f, "contigs", VCF_dat['contigs'])
+    _create_str(f, "samples", VCF_dat['samples'])
+    _create_str(f, "variants", VCF_dat['variants'])
+    _create_str(f, "comments", VCF_dat['comments'])
+
+    ## variant fixed information: store integer columns (e.g., POS) natively
+    ## and dictionary-encode low-cardinality ones (e.g., CHROM); both are
+    ## much smaller and faster than fixed-width strings
     fixed = f.create_group("FixedINFO")
     for _key in VCF_dat['FixedINFO']:
-        fixed.create_dataset(_key, data=np.string_(VCF_dat['FixedINFO'][_key]), 
-                             compression="gzip", compression_opts=9)
-        
-    ## genotype information for each sample
+        _vals = np.asarray(VCF_dat['FixedINFO'][_key])
+        try:
+            _ds = _create(fixed, _key, _vals.astype(np.int64))
+            _ds.attrs['encoding'] = 'int64'
+            continue
+        except ValueError:
+            pass
+        _uniq, _inv = np.unique(_vals, return_inverse=True)
+        if 0 < len(_uniq) <= 256:
+            _grp = fixed.create_group(_key)
+            _grp.attrs['encoding'] = 'categorical'
+            _create(_grp, "codes", _inv.astype(np.uint8))
+            _create_str(_grp, "dict", _uniq)
+        else:
+            _create_str(fixed, _key, _vals)
+
+    ## genotype information for each sample; for the sparse layout the CSR
+    ## index arrays and integer fields (AD, DP) are stored natively instead
+    ## of as strings, so readers can build a csr_matrix without any parsing
     geno = f.create_group("GenoINFO")
+    _is_sparse = 'indptr' in VCF_dat['GenoINFO']
+    if _is_sparse:
+        geno.attrs['encoding'] = 'csr'
     for _key in VCF_dat['GenoINFO']:
-        geno.create_dataset(_key, data=np.string_(VCF_dat['GenoINFO'][_key]), 
-                             compression="gzip", compression_opts=9)
-        
+        _vals = VCF_dat['GenoINFO'][_key]
+        if _key in ('indices', 'indptr', 'shape'):
+            _ds = _create(geno, _key, np.asarray(_vals, dtype=np.int64))
+            _ds.attrs['encoding'] = 'int64'
+        elif _is_sparse:
+            _vals = np.asarray(_vals)
+            try:
+                _ds = _create(geno, _key, _vals.astype(np.int32))
+                _ds.attrs['encoding'] = 'int32'
+            except ValueError:
+                _create_str(geno, _key, _vals)
+        else:
+            _create_str(geno, _key, _vals)
+
     f.close()
 
 
@@ -166,10 +255,17 @@ def read_sparse_GeneINFO(GenoINFO, keys=['AD', 'DP'], axes=[-1, -1]):
     
     RV = {}
     for i in range(len(keys)):
-        _dat = [x.split(",")[axes[i]] for x in GenoINFO[keys[i]]]
-        _dat = [x if x != '.' else '0' for x in _dat]
-        data = np.array(_dat).astype('float')
-        RV[keys[i]] = csr_matrix((data, indices, indptr), shape=(N, M))
+        raw = np.asarray(GenoINFO[keys[i]], dtype=np.str_)
+        ## extract the axes[i]-th comma field with C-level string ops
+        if axes[i] == -1:
+            _dat = np.char.rpartition(raw, ",")[..., 2]
+        elif axes[i] == 0:
+            _dat = np.char.partition(raw, ",")[..., 0]
+        else:
+            _dat = np.array([x.split(",")[axes[i]] for x in raw])
+        data = np.where(_dat == ".", "0", _dat).astype(np.float32)
+        RV[keys[i]] = csr_matrix((data, indices, indptr), shape=(N, M),
+                                 dtype=np.float32)
     return RV
 
 
@@ -184,28 +280,41 @@ def GenoINFO_maker(GT_prob, AD_reads, DP_reads):
     AD_reads = np.round(AD_reads).astype(int).astype(str)
     DP_reads = np.round(DP_reads).astype(int).astype(str)
 
-    GT, PL, AD, DP = [], [], [], []
-    for i in range(GT_prob.shape[0]):
-        GT.append([['0/0', '1/0', '1/1'][x] for x in GT_val[i, :]])
-        PL.append([",".join(list(x)) for x in PL_prob[i, :, :]])
-        AD.append(list(AD_reads[i, :]))
-        DP.append(list(DP_reads[i, :]))
-    
+    GT = np.array(['0/0', '1/0', '1/1'])[GT_val]  #(n_var, n_donor)
+    ## join the three PL fields with C-level string concatenation
+    _sep = np.full(PL_prob.shape[:2], ',', dtype='<U1')
+    PL = np.char.add(np.char.add(PL_prob[:, :, 0], _sep),
+         np.char.add(PL_prob[:, :, 1],
+         np.char.add(_sep, PL_prob[:, :, 2])))
+
     RV = {}
     RV['GT'] = GT
-    RV['AD'] = AD
-    RV['DP'] = DP
+    RV['AD'] = AD_reads
+    RV['DP'] = DP_reads
     RV['PL'] = PL
     return RV
 
 
 def write_VCF(out_file, VCF_dat, GenoTags=['GT', 'AD', 'DP', 'PL']):
+    import shutil
+    import pandas as pd
+
     if out_file.endswith(".gz"):
-        out_file_use = out_file.split(".gz")[0]
+        out_file_gz = out_file
     else:
-        out_file_use = out_file
-        
-    fid_out = open(out_file_use, "w")
+        out_file_gz = out_file + ".gz"
+
+    ## stream rows straight into the compressor rather than writing the
+    ## plain text file and re-reading it for compression afterwards
+    if shutil.which("bgzip") is not None:
+        fid_gz = open(out_file_gz, "wb")
+        pro = subprocess.Popen(["bgzip", "-c"], stdin=subprocess.PIPE,
+                               stdout=fid_gz)
+        fid_out = io.TextIOWrapper(pro.stdin, encoding="utf-8", newline="\n")
+    else:
+        fid_gz, pro = None, None
+        fid_out = gzip.open(out_file_gz, "wt")
+
     for line in VCF_dat['comments']:
         fid_out.writelines(line + "\n")
     
@@ -213,25 +322,26 @@ def write_VCF(out_file, VCF_dat, GenoTags=['GT', 'AD', 'DP', 'PL']):
                   "INFO", "FORMAT"]
     fid_out.writelines("#" + "\t".join(VCF_COLUMN + VCF_dat['samples']) + "\n")
     
-    for i in range(len(VCF_dat['variants'])):
-        line = [VCF_dat['FixedINFO'][x][i] for x in VCF_COLUMN[:8]]
-        line.append(":".join(GenoTags))
-
-        # for d in range(len(VCF_dat['GenoINFO'][GenoTags[0]][0])):
-            # _line_tag = [VCF_dat['GenoINFO'][x][i][d] for x in GenoTags]
-        for s in range(len(VCF_dat['samples'])):
-            _line_tag = [VCF_dat['GenoINFO'][_tag][i][s] for _tag in GenoTags]
-            line.append(":".join(_line_tag))
-        fid_out.writelines("\t".join(line) + "\n")
-    fid_out.close()
+    n_var = len(VCF_dat['variants'])
+    cols = [np.asarray(VCF_dat['FixedINFO'][x], dtype=np.str_)
+            for x in VCF_COLUMN[:8]]
+    cols.append(np.full(n_var, ":".join(GenoTags)))
 
-    import shutil
-    if shutil.which("bgzip") is not None:
-        bashCommand = "bgzip -f %s" %(out_file_use)
-    else:
-        bashCommand = "gzip -f %s" %(out_file_use)
-    pro = subprocess.Popen(bashCommand.split(), stdout=subprocess.PIPE)
-    pro.communicate()[0]
+    ## join the genotype tags per sample with C-level string concatenation
+    _geno = [np.asarray(VCF_dat['GenoINFO'][_tag], dtype=np.str_)
+             for _tag in GenoTags]
+    cells = _geno[0]
+    for _tag_dat in _geno[1:]:
+        cells = np.char.add(np.char.add(cells, ":"), _tag_dat)
+
+    ## single writer call instead of a Python loop per variant
+    df = pd.DataFrame(np.column_stack(cols + [cells]))
+    df.to_csv(fid_out, sep="\t", header=False, index=False,
+              quoting=csv.QUOTE_NONE, lineterminator="\n")
+    fid_out.close()
+    if pro is not None:
+        pro.wait()
+        fid_gz.close()
 
     
 def parse_donor_GPb(GT_dat, tag='GT', min_prob=0.0):
@@ -239,30 +349,39 @@ def parse_donor_GPb(GT_dat, tag='GT', min_prob=0.0):
     Parse the donor genotype probability
     tag: GT, GP, or PL
     """
-    def parse_GT_code(code, tag, min_prob=0):
-        if code == "." or code == "./." or code == ".|.":
-            return np.array([1/3, 1/3, 1/3])
-        if tag == 'GT':
-            _prob = np.array([0, 0, 0], float)
-            _prob[int(float(code[0]) + float(code[-1]))] = 1
-        elif tag == 'GP':
-            _prob = np.array(code.split(','), float)
-        elif tag == 'PL':
-            _Phred = np.array(code.split(','), float)
-            _prob = 10**(-0.1 * (_Phred - min(_Phred)) - 0.025) # 0?
-        else:
-            _prob = None
-            
-        _prob += min_prob
-        return _prob / np.sum(_prob)
-
     if ['GT', 'GP', 'PL'].count(tag) == 0:
         print("[parse_donor_GPb] Error: no support tag: %s" %tag)
         return None
 
-    GT_prob = np.zeros((len(GT_dat), len(GT_dat[0]), 3))
-    for i in range(GT_prob.shape[0]):
-        for j in range(GT_prob.shape[1]):
-            GT_prob[i, j, :] = parse_GT_code(GT_dat[i][j], tag,
-                                             min_prob)
+    codes = np.asarray(GT_dat, dtype=np.str_)
+    n_var, n_donor = codes.shape
+    missing = (codes == ".") | (codes == "./.") | (codes == ".|.")
+
+    ## placeholders keep the vector ops valid; missing entries are reset below
+    _holder = {'GT': '0/0', 'GP': '1,1,1', 'PL': '0,0,0'}[tag]
+    flat = np.where(missing, _holder, codes).ravel()
+
+    if tag == 'GT':
+        ## the first and the last characters hold the two allele calls
+        chars = flat.view('U1').reshape(flat.shape[0], -1)
+        a1 = chars[:, 0].astype(float)
+        a2 = chars[np.arange(chars.shape[0]),
+                   np.char.str_len(flat) - 1].astype(float)
+        _idx = (a1 + a2).astype(int).reshape(n_var, n_donor, 1)
+        GT_prob = np.zeros((n_var, n_donor, 3))
+        np.put_along_axis(GT_prob, _idx, 1.0, axis=2)
+    else:
+        ## split the three comma fields at C level with two partitions
+        _part1 = np.char.partition(flat, ',')
+        _part2 = np.char.partition(_part1[:, 2], ',')
+        _vals = np.stack([_part1[:, 0], _part2[:, 0], _part2[:, 2]],
+                         axis=1).astype(float)
+        GT_prob = _vals.reshape(n_var, n_donor, 3)
+        if tag == 'PL':
+            GT_prob = 10**(-0.1 * (GT_prob - GT_prob.min(axis=2,
+                keepdims=True)) - 0.025) # 0?
+
+    GT_prob += min_prob
+    GT_prob /= np.sum(GT_prob, axis=2, keepdims=True)
+    GT_prob[missing, :] = 1.0 / 3
     return GT_prob
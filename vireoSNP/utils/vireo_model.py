@@ -399,14 +399,16 @@ def add_doublet_GT(GT_prob):
     GT_prob2 = np.zeros((GT_prob.shape[0], sp_idx.shape[0],
                          n_gt + gt_idx.shape[0]))
 
-    GT_prob2[:, :, :n_gt] = (GT_prob[:, s_idx1, :] * 
-                             GT_prob[:, s_idx2, :])
-    GT_prob2[:, :, n_gt:] = (GT_prob[:, s_idx1, :][:, :, g_idx1] * 
-                             GT_prob[:, s_idx2, :][:, :, g_idx2] +
-                             GT_prob[:, s_idx1, :][:, :, g_idx2] * 
-                             GT_prob[:, s_idx2, :][:, :, g_idx1])
-    
-    GT_prob2 = normalize(GT_prob2, axis=2)
-    GT_prob1 = np.append(GT_prob, 
+    ## single outer product over genotype pairs; the diagonal gives the
+    ## shared genotypes and the symmetric off-diagonals the mixed ones
+    _outer = (GT_prob[:, s_idx1, :, np.newaxis] *
+              GT_prob[:, s_idx2, np.newaxis, :])
+    _diag = np.arange(n_gt)
+    GT_prob2[:, :, :n_gt] = _outer[:, :, _diag, _diag]
+    GT_prob2[:, :, n_gt:] = (_outer[:, :, g_idx1, g_idx2] +
+                             _outer[:, :, g_idx2, g_idx1])
+
+    ## no normalization needed: the slots partition the full outer product
+    GT_prob1 = np.append(GT_prob,
         np.zeros((GT_prob.shape[0], GT_prob.shape[1], gt_idx.shape[0])), axis=2)
     return np.append(GT_prob1, GT_prob2, axis=1)
@@ -23,6 +23,12 @@ def vireo_core(AD, DP, n_donor=None, GT_prior=None, learn_GT=True,
     if random_seed is not None:
         np.random.seed(random_seed)
 
+    ## float32 read counts halve the memory traffic of the sparse products
+    if AD.dtype != np.float32:
+        AD = AD.astype(np.float32)
+    if DP.dtype != np.float32:
+        DP = DP.astype(np.float32)
+
     if n_donor is None:
         if len(GT_prior.shape) < 3 or GT_prior.shape[1] < 2:
             print("Error: no n_donor and GT_prior has < 2 donors.")
@@ -85,13 +91,22 @@ def vireo_core(AD, DP, n_donor=None, GT_prior=None, learn_GT=True,
         print("Error: number of GT categories not matched: theta and GT_prior")
         sys.exit(1)
 
+    ## preallocate log-likelihood buffers shared across the VB iterations
+    ## and cache the log of the (fixed) genotype prior
+    n_comp = n_donor
+    if check_doublet:
+        n_comp += int(n_donor * (n_donor - 1) / 2)
+    _buffers = (np.zeros((AD.shape[1], n_comp)), np.zeros(GT_prior.shape))
+    GT_prior_log = np.log(GT_prior)
+
     ## VB interations
     LB = np.zeros(max_iter)
     for it in range(max_iter):
-        ID_prob, GT_prob, theta_shapes, LB[it] = update_VB(AD, DP, GT_prob, 
+        ID_prob, GT_prob, theta_shapes, LB[it] = update_VB(AD, DP, GT_prob,
             theta_shapes, theta_prior, GT_prior, Psi, doublet_prior,
-            learn_GT=learn_GT, learn_theta=learn_theta, 
-            check_doublet=check_doublet)
+            learn_GT=learn_GT, learn_theta=learn_theta,
+            check_doublet=check_doublet, buffers=_buffers,
+            GT_prior_log=GT_prior_log)
 
         if it > min_iter:
             if LB[it] < LB[it - 1]:
@@ -105,9 +120,10 @@ def vireo_core(AD, DP, n_donor=None, GT_prior=None, learn_GT=True,
 
     ## one-off check doublet
     if check_doublet:
-        ID_prob2, GT_prob, theta_shapes, LB_doublet = update_VB(AD, DP, GT_prob, 
+        ID_prob2, GT_prob, theta_shapes, LB_doublet = update_VB(AD, DP, GT_prob,
             theta_shapes, theta_prior, GT_prior, Psi, doublet_prior,
-            learn_GT=True, learn_theta=learn_theta, check_doublet=True)
+            learn_GT=True, learn_theta=learn_theta, check_doublet=True,
+            buffers=_buffers, GT_prior_log=GT_prior_log)
 
         ID_prob = ID_prob2[:, :n_donor]
         doublet_prob = ID_prob2[:, n_donor:]
@@ -126,15 +142,22 @@ def vireo_core(AD, DP, n_donor=None, GT_prior=None, learn_GT=True,
     return RV
 
 
-def update_VB(AD, DP, GT_prob, theta_shapes, theta_prior, GT_prior, 
-    Psi, doublet_prior=None, learn_GT=True, learn_theta=True, 
-    check_doublet=False):
+def update_VB(AD, DP, GT_prob, theta_shapes, theta_prior, GT_prior,
+    Psi, doublet_prior=None, learn_GT=True, learn_theta=True,
+    check_doublet=False, buffers=None, GT_prior_log=None):
     """
-    Update the parameters of each component of the variantional 
-    distribution. 
-    
+    Update the parameters of each component of the variantional
+    distribution.
+
     The doublet probability can be created by doublet genotypes
+
+    buffers: optional tuple (logLik_ID, logLik_GT) of preallocated arrays
+    shared across iterations; see vireo_core.
+    GT_prior_log: optional precomputed np.log(GT_prior), cached across
+    iterations; see vireo_core.
     """
+    if buffers is None:
+        buffers = (None, None)
     if check_doublet:
         GT_both = add_doublet_GT(GT_prob)
         theta_both = add_doublet_theta(theta_shapes)
@@ -146,19 +169,26 @@ def update_VB(AD, DP, GT_prob, theta_shapes, theta_prior, GT_prior,
                              (np.ones(n_doublet_pair) / n_doublet_pair * 
                               doublet_prior))
     else:
-        Psi_both = Psi.copy()
-        GT_both = GT_prob.copy()
-        theta_both = theta_shapes.copy()
+        ## read-only in get_ID_prob, so no defensive copies needed
+        Psi_both = Psi
+        GT_both = GT_prob
+        theta_both = theta_shapes
 
-    ID_prob2, logLik_ID = get_ID_prob(AD, DP, GT_both, theta_both, Psi_both)
+    ID_prob2, logLik_ID = get_ID_prob(AD, DP, GT_both, theta_both, Psi_both,
+                                      out=buffers[0])
     ID_prob = ID_prob2[:, :GT_prob.shape[1]]
-    
+
+    ## the two sparse products are shared by the GT and theta updates
+    if learn_GT or learn_theta:
+        S_gt = (AD * ID_prob, DP * ID_prob)
     if learn_GT:
-        GT_prob, logLik_GT = get_GT_prob(AD, DP, ID_prob, 
-                                         theta_shapes, GT_prior)
+        GT_prob, logLik_GT = get_GT_prob(AD, DP, ID_prob,
+                                         theta_shapes, GT_prior,
+                                         out=buffers[1], S_gt=S_gt,
+                                         GT_prior_log=GT_prior_log)
     if learn_theta:
-        theta_shapes = get_theta_shapes(AD, DP, ID_prob, 
-                                        GT_prob, theta_prior)
+        theta_shapes = get_theta_shapes(AD, DP, ID_prob,
+                                        GT_prob, theta_prior, S_gt=S_gt)
     
     ### check how to calculate lower bound for when detecting doublets
     LB_val = VB_lower_bound(logLik_ID, GT_prob, ID_prob2, theta_shapes, 
@@ -168,37 +198,54 @@ def update_VB(AD, DP, GT_prob, theta_shapes, theta_prior, GT_prior,
 
 
 
-def get_theta_shapes(AD, DP, ID_prob, GT_prob, theta_prior):
+def get_theta_shapes(AD, DP, ID_prob, GT_prob, theta_prior, S_gt=None):
     """
+    S_gt: optional precomputed (AD * ID_prob, DP * ID_prob) pair, shared
+    with get_GT_prob to avoid repeating the two sparse products.
     """
-    S1_gt = AD * ID_prob
-    SS_gt = DP * ID_prob
+    if S_gt is None:
+        S1_gt = AD * ID_prob
+        SS_gt = DP * ID_prob
+    else:
+        S1_gt, SS_gt = S_gt
     S2_gt = SS_gt - S1_gt
-    
+
     theta_shapes = theta_prior.copy()
-    for ig in range(theta_shapes.shape[0]):
-        _axis = 1 if len(theta_shapes.shape) == 3 else None
-        theta_shapes[ig, 0] += np.sum(S1_gt * GT_prob[:, :, ig], axis=_axis)
-        theta_shapes[ig, 1] += np.sum(S2_gt * GT_prob[:, :, ig], axis=_axis)
+    if len(theta_shapes.shape) == 3:
+        theta_shapes[:, 0] += np.einsum('vd,vdg->gv', S1_gt, GT_prob)
+        theta_shapes[:, 1] += np.einsum('vd,vdg->gv', S2_gt, GT_prob)
+    else:
+        theta_shapes[:, 0] += np.einsum('vd,vdg->g', S1_gt, GT_prob)
+        theta_shapes[:, 1] += np.einsum('vd,vdg->g', S2_gt, GT_prob)
     return theta_shapes
 
-def get_ID_prob(AD, DP, GT_prob, theta_shapes, Psi=None):
+def get_ID_prob(AD, DP, GT_prob, theta_shapes, Psi=None, out=None):
     """
+    out: optional preallocated (n_cell, n_donor) buffer for logLik_ID,
+    reused across VB iterations to avoid repeated allocation.
     """
     if Psi is None:
         Psi = np.ones(GT_prob.shape[1]) / GT_prob.shape[1]
 
-    BD = DP - AD
-    logLik_ID = np.zeros((AD.shape[1], GT_prob.shape[1]))
-    for ig in range(GT_prob.shape[2]):
-        _digmma1 = digamma(theta_shapes[ig, 0]).reshape(-1, 1)
-        _digmma2 = digamma(theta_shapes[ig, 1]).reshape(-1, 1)
-        _digmmas = digamma(theta_shapes[ig, :].sum(axis=0)).reshape(-1, 1)
-        S1 = AD.transpose() * (GT_prob[:, :, ig] * _digmma1)
-        S2 = BD.transpose() * (GT_prob[:, :, ig] * _digmma2)
-        SS = DP.transpose() * (GT_prob[:, :, ig] * _digmmas)
-        logLik_ID += (S1 + S2 - SS)
-    
+    ## fused form of the per-genotype loop: with BD = DP - AD, the
+    ## log-likelihood is AD^T (A1 - A2) + DP^T (A2 - AS), so AD and DP are
+    ## each streamed through a single sparse product
+    _digmma1 = digamma(theta_shapes[:, 0])
+    _digmma2 = digamma(theta_shapes[:, 1])
+    _digmmas = digamma(theta_shapes[:, 0] + theta_shapes[:, 1])
+    if len(theta_shapes.shape) == 3:
+        W1 = np.einsum('vdg,gv->vd', GT_prob, _digmma1 - _digmma2)
+        W2 = np.einsum('vdg,gv->vd', GT_prob, _digmma2 - _digmmas)
+    else:
+        W1 = GT_prob @ (_digmma1 - _digmma2)
+        W2 = GT_prob @ (_digmma2 - _digmmas)
+
+    if out is None:
+        logLik_ID = AD.transpose() * W1 + DP.transpose() * W2
+    else:
+        logLik_ID = out
+        np.add(AD.transpose() * W1, DP.transpose() * W2, out=logLik_ID)
+
     Psi_norm = np.log(Psi / np.sum(Psi))
     ID_prob = np.exp(loglik_amplify(logLik_ID + Psi_norm, axis=1))
     ID_prob = normalize(ID_prob, axis=1)
@@ -206,29 +253,51 @@ def get_ID_prob(AD, DP, GT_prob, theta_shapes, Psi=None):
     return ID_prob, logLik_ID
     
 
-def get_GT_prob(AD, DP, ID_prob, theta_shapes, GT_prior=None):
+def get_GT_prob(AD, DP, ID_prob, theta_shapes, GT_prior=None, out=None,
+    S_gt=None, GT_prior_log=None):
     """
+    out: optional preallocated (n_var, n_donor, n_gt) buffer for logLik_GT,
+    reused across VB iterations to avoid repeated allocation.
+    S_gt: optional precomputed (AD * ID_prob, DP * ID_prob) pair, shared
+    with get_theta_shapes to avoid repeating the two sparse products.
+    GT_prior_log: optional precomputed np.log(GT_prior); the prior never
+    changes across iterations, so the log can be taken once.
     """
     if GT_prior is None:
-        GT_prior = np.ones((AD.shape[0], ID_prob.shape[1], 
-                            theta_shapes.shape[0])) 
+        GT_prior = np.ones((AD.shape[0], ID_prob.shape[1],
+                            theta_shapes.shape[0]))
         GT_prior = GT_prior / theta_shapes.shape[0]
-        
-    S1_gt = AD * ID_prob
-    SS_gt = DP * ID_prob
-    S2_gt = SS_gt - S1_gt
-    
-    logLik_GT = np.zeros(GT_prior.shape)
-    for ig in range(logLik_GT.shape[2]):        
-        _digmma1 = digamma(theta_shapes[ig, 0]).reshape(-1, 1)
-        _digmma2 = digamma(theta_shapes[ig, 1]).reshape(-1, 1)
-        _digmmas = digamma(theta_shapes[ig, :].sum(axis=0)).reshape(-1, 1)
-        logLik_GT[:, :, ig] = (S1_gt * _digmma1 + 
-                               S2_gt * _digmma2 - 
-                               SS_gt * _digmmas)
-        
+    if GT_prior_log is None:
+        GT_prior_log = np.log(GT_prior)
+
+    if S_gt is None:
+        S1_gt = AD * ID_prob
+        SS_gt = DP * ID_prob
+    else:
+        S1_gt, SS_gt = S_gt
+
+    ## fused form of the per-genotype loop: with S2 = SS - S1, the
+    ## log-likelihood is S1 (dg1 - dg2) + SS (dg2 - dgs) per genotype
+    _digmma1 = digamma(theta_shapes[:, 0])
+    _digmma2 = digamma(theta_shapes[:, 1])
+    _digmmas = digamma(theta_shapes[:, 0] + theta_shapes[:, 1])
+    if len(theta_shapes.shape) == 3:
+        W1 = (_digmma1 - _digmma2).T[:, np.newaxis, :]  #(n_var, 1, n_gt)
+        W2 = (_digmma2 - _digmmas).T[:, np.newaxis, :]
+    else:
+        W1 = _digmma1 - _digmma2
+        W2 = _digmma2 - _digmmas
+
+    if out is None:
+        logLik_GT = (S1_gt[:, :, np.newaxis] * W1 +
+                     SS_gt[:, :, np.newaxis] * W2)
+    else:
+        logLik_GT = out
+        np.multiply(S1_gt[:, :, np.newaxis], W1, out=logLik_GT)
+        logLik_GT += SS_gt[:, :, np.newaxis] * W2
+
     # += np.log(GT_prior)
-    GT_prob = loglik_amplify(logLik_GT + np.log(GT_prior), axis=2)
+    GT_prob = loglik_amplify(logLik_GT + GT_prior_log, axis=2)
     GT_prob = normalize(np.exp(GT_prob), axis=2)
     
     return GT_prob, logLik_GT
@@ -303,14 +372,16 @@ def add_doublet_GT(GT_prob):
     GT_prob2 = np.zeros((GT_prob.shape[0], sp_idx.shape[0],
                          n_gt + gt_idx.shape[0]))
 
-    GT_prob2[:, :, :n_gt] = (GT_prob[:, s_idx1, :] * 
-                             GT_prob[:, s_idx2, :])
-    GT_prob2[:, :, n_gt:] = (GT_prob[:, s_idx1, :][:, :, g_idx1] * 
-                             GT_prob[:, s_idx2, :][:, :, g_idx2] +
-                             GT_prob[:, s_idx1, :][:, :, g_idx2] * 
-                             GT_prob[:, s_idx2, :][:, :, g_idx1])
-    
-    GT_prob2 = normalize(GT_prob2, axis=2)
-    GT_prob1 = np.append(GT_prob, 
+    ## single outer product over genotype pairs; the diagonal gives the
+    ## shared genotypes and the symmetric off-diagonals the mixed ones
+    _outer = (GT_prob[:, s_idx1, :, np.newaxis] *
+              GT_prob[:, s_idx2, np.newaxis, :])
+    _diag = np.arange(n_gt)
+    GT_prob2[:, :, :n_gt] = _outer[:, :, _diag, _diag]
+    GT_prob2[:, :, n_gt:] = (_outer[:, :, g_idx1, g_idx2] +
+                             _outer[:, :, g_idx2, g_idx1])
+
+    ## no normalization needed: the slots partition the full outer product
+    GT_prob1 = np.append(GT_prob,
         np.zeros((GT_prob.shape[0], GT_prob.shape[1], gt_idx.shape[0])), axis=2)
     return np.append(GT_prob1, GT_prob2, axis=1)
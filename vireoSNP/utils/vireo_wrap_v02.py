@@ -4,17 +4,26 @@ from .vireo_base import normalize, greed_match, donor_select
 from .vireo_model_v02 import vireo_core
 
 
-def vireo_flock(AD, DP, GT_prior=None, n_donor=None, n_extra_donor=2, 
-               extra_donor_mode="distance", n_init=20, random_seed=None, 
-               check_doublet=True, **kwargs):
+def vireo_flock(AD, DP, GT_prior=None, n_donor=None, n_extra_donor=2,
+               extra_donor_mode="distance", n_init=20, n_proc=1,
+               random_seed=None, check_doublet=True, **kwargs):
     """
-    A wrap function to run vireo twice, with the first step searching many 
+    A wrap function to run vireo twice, with the first step searching many
     initialations.
+
+    n_proc: number of processes for the warm-up initializations; these runs
+    are independent, so they parallelize embarrassingly.
     """
     ## random seed setting
     if random_seed is not None:
         np.random.seed(random_seed)
 
+    ## cast once here so the warm-up runs don't each re-convert
+    if AD.dtype != np.float32:
+        AD = AD.astype(np.float32)
+    if DP.dtype != np.float32:
+        DP = DP.astype(np.float32)
+
     if n_donor is None:
         if GT_prior is None:
             print("[vireo] Error: requiring n_donor or GT_prior.")
@@ -34,11 +43,23 @@ def vireo_flock(AD, DP, GT_prior=None, n_donor=None, n_extra_donor=2,
             _ID_prob = np.random.rand(AD.shape[1], n_donor_run1)
             ID_prob_list.append(normalize(_ID_prob))
 
-        result = []
-        for _ID_prob in ID_prob_list:
-            result.append(vireo_core(AD, DP, n_donor=n_donor_run1,
-                GT_prior = None, ID_prob_init=_ID_prob, min_iter=5, max_iter=15, 
-                verbose=False, check_doublet=False, **kwargs))
+        if n_proc > 1:
+            import multiprocessing as mp
+            pool = mp.Pool(processes=n_proc)
+            _jobs = [pool.apply_async(vireo_core, (AD, DP),
+                dict(n_donor=n_donor_run1, GT_prior=None, ID_prob_init=_ip,
+                     min_iter=5, max_iter=15, verbose=False,
+                     check_doublet=False, **kwargs))
+                for _ip in ID_prob_list]
+            pool.close()
+            pool.join()
+            result = [x.get() for x in _jobs]
+        else:
+            result = []
+            for _ID_prob in ID_prob_list:
+                result.append(vireo_core(AD, DP, n_donor=n_donor_run1,
+                    GT_prior = None, ID_prob_init=_ID_prob, min_iter=5,
+                    max_iter=15, verbose=False, check_doublet=False, **kwargs))
 
         LB_list = [x['LB_list'][-1] for x in result]
         res1 = result[np.argmax(LB_list)]